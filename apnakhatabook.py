@@ -1,41 +1,182 @@
 import streamlit as st
 import sqlite3
+from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime
 import pandas as pd
+import csv
+import functools
 import hashlib
+import hmac
+import io
+import os
+import queue
+import threading
+import time
 
 # -----------------------------
 # Database Setup
 # -----------------------------
-conn = sqlite3.connect("lendenwebapp.db", check_same_thread=False)
+DB_PATH = "lendenwebapp.db"
+READ_POOL_SIZE = 4
+
+
+def open_connection(database, **kwargs):
+    # Autocommit mode: writes open their own transaction()
+    db = sqlite3.connect(database, check_same_thread=False, isolation_level=None, **kwargs)
+    try:
+        db.execute("PRAGMA temp_store=MEMORY")
+        db.execute("PRAGMA cache_size=-20000")
+        db.execute("PRAGMA mmap_size=268435456")
+    except sqlite3.OperationalError:
+        pass  # keep SQLite defaults
+    return db
+
+
+@st.cache_resource
+def get_connections():
+    # One writer shared by every session, plus a pool of read-only connections
+    writer = open_connection(DB_PATH)
+    # WAL lets the readers keep going while the writer commits; NORMAL sync is safe under WAL
+    try:
+        writer.execute("PRAGMA journal_mode=WAL")
+        writer.execute("PRAGMA synchronous=NORMAL")
+    except sqlite3.OperationalError:
+        pass  # e.g. read-only filesystem
+    readers = queue.Queue()
+    for _ in range(READ_POOL_SIZE):
+        readers.put(open_connection(f"file:{DB_PATH}?mode=ro", uri=True))
+    return writer, threading.Lock(), readers
+conn, write_lock, read_pool = get_connections()
 c = conn.cursor()
 
-# Users table
-c.execute('''CREATE TABLE IF NOT EXISTS users (
-                username TEXT PRIMARY KEY,
-                password TEXT,
-                role TEXT
-            )''')
-
-# Records table
-c.execute('''CREATE TABLE IF NOT EXISTS records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                owner_username TEXT,
-                received REAL DEFAULT 0,
-                paid_out REAL DEFAULT 0,
-                datetime TEXT,
-                payee TEXT,
-                total_paid REAL DEFAULT 0,
-                total_received REAL DEFAULT 0,
-                note TEXT DEFAULT ''
-            )''')
-conn.commit()
+
+@contextmanager
+def transaction():
+    # All use of the shared writer goes through here, one session at a time.
+    # IMMEDIATE takes SQLite's write lock up front, so read-modify-write steps can't interleave.
+    with write_lock:
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            c.execute("COMMIT")
+        except BaseException:
+            # Also covers a failed COMMIT; never leave the shared writer inside a transaction
+            if conn.in_transaction:
+                c.execute("ROLLBACK")
+            raise
+
+
+@contextmanager
+def read_cursor():
+    reader = read_pool.get()
+    try:
+        yield reader.cursor()
+    finally:
+        read_pool.put(reader)
+
+
+def refresh_payee_summary(owner, payee):
+    # Recompute one payee's totals from records; drops the row once no records are left.
+    # Replayed in id order like update_record, since the zero clamp on total_received depends on order.
+    # Legacy rows may hold NULL amounts or datetimes
+    c.execute('''SELECT COALESCE(received, 0), COALESCE(paid_out, 0), datetime FROM records
+                 WHERE owner_username=? AND payee=? ORDER BY id''', (owner, payee))
+    rows = c.fetchall()
+    c.execute("DELETE FROM payee_summary WHERE owner_username=? AND payee=?", (owner, payee))
+    if not rows:
+        return
+    balance = total_paid = total_received = 0
+    last_dt = None
+    for received, paid_out, record_dt in rows:
+        balance += received - paid_out
+        total_paid += paid_out
+        total_received = max(0, total_received + received - paid_out)
+        if record_dt is not None and (last_dt is None or record_dt > last_dt):
+            last_dt = record_dt
+    c.execute('''INSERT INTO payee_summary (owner_username, payee, balance, total_paid, total_received, last_dt)
+                 VALUES (?, ?, ?, ?, ?, ?)''',
+              (owner, payee, balance, total_paid, total_received, last_dt))
+
+
+def create_schema():
+    with transaction():
+        # Users table
+        c.execute('''CREATE TABLE IF NOT EXISTS users (
+                        username TEXT PRIMARY KEY,
+                        password TEXT,
+                        role TEXT
+                    )''')
+
+        # Records table
+        c.execute('''CREATE TABLE IF NOT EXISTS records (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        owner_username TEXT,
+                        received REAL DEFAULT 0,
+                        paid_out REAL DEFAULT 0,
+                        datetime TEXT,
+                        payee TEXT,
+                        total_paid REAL DEFAULT 0,
+                        total_received REAL DEFAULT 0,
+                        note TEXT DEFAULT ''
+                    )''')
+
+        # Per-payee totals, kept in step with records by the write helpers.
+        # total_received is the running balance clamped at zero, as snapshotted into records.
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='payee_summary'")
+        summary_missing = c.fetchone() is None
+        c.execute('''CREATE TABLE IF NOT EXISTS payee_summary (
+                        owner_username TEXT,
+                        payee TEXT,
+                        balance REAL DEFAULT 0,
+                        total_paid REAL DEFAULT 0,
+                        total_received REAL DEFAULT 0,
+                        last_dt TEXT,
+                        PRIMARY KEY (owner_username, payee)
+                    )''')
+        if summary_missing:
+            c.execute("SELECT DISTINCT owner_username, payee FROM records")
+            for owner, payee in c.fetchall():
+                refresh_payee_summary(owner, payee)
+
+        # Indexes for the per-owner lookups (by payee, latest record, date order)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_records_owner_payee ON records(owner_username, payee, id DESC)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_records_owner_dt ON records(owner_username, datetime)")
+
+
+def analyze_db():
+    # Refresh planner statistics so SQLite keeps picking the indexes as data grows;
+    # analysis_limit samples large indexes instead of scanning them in full
+    with transaction():
+        c.execute("PRAGMA analysis_limit=1000")
+        c.execute("ANALYZE")
 
 
 # -----------------------------
 # Helper: Password Hashing
 # -----------------------------
+PBKDF2_ITERATIONS = 600000
+
+
 def hash_password(password):
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+
+def check_password(password, stored):
+    if not stored:
+        return False
+    if not stored.startswith("pbkdf2_sha256$"):
+        # Legacy unsalted SHA-256 hash
+        return hmac.compare_digest(stored, password_fingerprint(password))
+    _, iterations, salt, digest = stored.split("$")
+    candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(candidate.hex(), digest)
+
+
+def password_fingerprint(password):
+    # Cheap digest used to recognise a repeat login without re-running the KDF
     return hashlib.sha256(password.encode()).hexdigest()
 
 
@@ -43,126 +184,218 @@ def hash_password(password):
 # Default Admin Account (Auto Fix)
 # -----------------------------
 def ensure_admin():
-    c.execute("SELECT username, password FROM users WHERE username='admin'")
-    admin = c.fetchone()
-    if not admin:
-        c.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-                  ("admin", hash_password("vinsolit"), "admin"))
-        conn.commit()
-    else:
-        if admin[1] == "vinsolit":
-            c.execute("UPDATE users SET password=? WHERE username='admin'",
-                      (hash_password("vinsolit"),))
-            conn.commit()
-ensure_admin()
+    hashed = hash_password("vinsolit")  # derive before taking the write lock
+    with transaction():
+        c.execute("SELECT username, password FROM users WHERE username='admin'")
+        admin = c.fetchone()
+        if not admin:
+            c.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                      ("admin", hashed, "admin"))
+        else:
+            if admin[1] == "vinsolit":
+                c.execute("UPDATE users SET password=? WHERE username='admin'",
+                          (hashed,))
+
+
+@st.cache_resource
+def init_db():
+    # Schema and default admin only need checking once per process, not on every rerun
+    create_schema()
+    ensure_admin()
+    analyze_db()
+init_db()
+
+
+# -----------------------------
+# Helper: Auth Cache
+# -----------------------------
+ROLE_CACHE_TTL = 300  # seconds
+
+
+@st.cache_resource
+def get_role_cache():
+    # username -> (password fingerprint, role, cached_at); shared across reruns and sessions
+    return {}
+_role_cache = get_role_cache()
 
 
 # -----------------------------
 # Helper Functions
 # -----------------------------
 def add_user(username, password):
+    hashed = hash_password(password)
     try:
-        c.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-                  (username, hash_password(password), "user"))
-        conn.commit()
-        return True
+        with transaction():
+            c.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                      (username, hashed, "user"))
     except sqlite3.IntegrityError:
         return False
+    get_all_users_for_admin.clear()
+    return True
+
+
+def reset_password(username, new_password):
+    hashed = hash_password(new_password)
+    with transaction():
+        c.execute("UPDATE users SET password=? WHERE username=?", (hashed, username))
+    _role_cache.pop(username, None)
 
 
 def verify_user(username, password):
-    c.execute("SELECT * FROM users WHERE username=? AND password=?",
-              (username, hash_password(password)))
-    return c.fetchone()
+    # Hashing only happens for a username that exists
+    cached = _role_cache.get(username)
+    if cached and time.time() - cached[2] < ROLE_CACHE_TTL:
+        if hmac.compare_digest(cached[0], password_fingerprint(password)):
+            return (username, None, cached[1])
+
+    with read_cursor() as rc:
+        rc.execute("SELECT username, password, role FROM users WHERE username=?", (username,))
+        user = rc.fetchone()
+    if user is None:
+        return None
+    if not check_password(password, user[1]):
+        return None
+    legacy = not user[1].startswith("pbkdf2_sha256$")
+    hashed = hash_password(password) if legacy else None
+    fingerprint = password_fingerprint(password)
+    # Re-check the stored hash under the write lock before caching, so a reset or
+    # delete that committed after the read above can't leave a stale cache entry
+    with transaction():
+        if legacy:
+            # Upgrade the legacy hash now that the plain password is known
+            c.execute("UPDATE users SET password=? WHERE username=? AND password=?",
+                      (hashed, username, user[1]))
+            unchanged = c.rowcount > 0
+        else:
+            c.execute("SELECT 1 FROM users WHERE username=? AND password=?", (username, user[1]))
+            unchanged = c.fetchone() is not None
+        if unchanged:
+            _role_cache[username] = (fingerprint, user[2], time.time())
+    return user if unchanged else None
 
 
-def get_records(owner):
-    c.execute("SELECT * FROM records WHERE owner_username=?", (owner,))
-    return c.fetchall()
+@st.cache_data(ttl=30)
+def get_all_users_for_admin():
+    with read_cursor() as rc:
+        rc.execute("SELECT username, role FROM users")
+        return rc.fetchall()
 
 
-# Modify update_record to accept optional datetime
-def update_record(owner, received, paid_out, payee, note="", record_datetime=None):
-    now = record_datetime.strftime("%Y-%m-%d %H:%M:%S") if record_datetime else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    c.execute("SELECT * FROM records WHERE owner_username=? AND payee=? ORDER BY id DESC LIMIT 1",
-              (owner, payee))
-    last_record = c.fetchone()
-    prev_total_received = last_record[7] if last_record else 0
-    prev_total_paid = last_record[6] if last_record else 0
+@st.cache_data(ttl=60, show_spinner=False)
+def get_payee_summaries(owner):
+    with read_cursor() as rc:
+        rc.execute("SELECT payee, balance, total_paid, last_dt FROM payee_summary WHERE owner_username=? ORDER BY last_dt DESC",
+                   (owner,))
+        return rc.fetchall()
+
 
-    new_total_received = prev_total_received + received - paid_out
-    if new_total_received < 0:
-        new_total_received = 0
-    new_total_paid = prev_total_paid + paid_out
+@st.cache_data(ttl=60, show_spinner=False)
+def get_payee_histories(owner):
+    with read_cursor() as rc:
+        rc.execute("SELECT id, received, paid_out, datetime, note, payee FROM records WHERE owner_username=? ORDER BY payee, datetime",
+                   (owner,))
+        rows = rc.fetchall()
+    histories = defaultdict(list)
+    for r in rows:
+        histories[r[5]].append(r)
+    return histories
 
-    c.execute('''INSERT INTO records 
-                 (owner_username, received, paid_out, datetime, payee, total_paid, total_received, note)
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-              (owner, received, paid_out, now, payee, new_total_paid, new_total_received, note))
-    conn.commit()
 
+def clear_record_caches():
+    # Called after every write to records; cached reads are shared by all sessions
+    get_payee_summaries.clear()
+    get_payee_histories.clear()
+    get_all_records.clear()
 
-def delete_record_by_id(record_id):
-    c.execute("DELETE FROM records WHERE id=?", (record_id,))
-    conn.commit()
+
+# Modify update_record to accept optional datetime
+def update_record(owner, received, paid_out, payee, note="", record_datetime=None):
+    now = record_datetime.strftime("%Y-%m-%d %H:%M:%S") if record_datetime else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    delta = received - paid_out
+
+    with transaction():
+        # Fold this entry into the payee's totals, then snapshot them into the new record
+        c.execute('''INSERT INTO payee_summary (owner_username, payee, balance, total_paid, total_received, last_dt)
+                     VALUES (?, ?, ?, ?, MAX(0, ?), ?)
+                     ON CONFLICT(owner_username, payee) DO UPDATE SET
+                         balance = balance + excluded.balance,
+                         total_paid = total_paid + excluded.total_paid,
+                         total_received = MAX(0, total_received + excluded.balance),
+                         last_dt = MAX(last_dt, excluded.last_dt)''',
+                  (owner, payee, delta, paid_out, delta, now))
+        c.execute('''INSERT INTO records 
+                     (owner_username, received, paid_out, datetime, payee, total_paid, total_received, note)
+                     SELECT ?, ?, ?, ?, ?, total_paid, total_received, ?
+                     FROM payee_summary WHERE owner_username=? AND payee=?''',
+                  (owner, received, paid_out, now, payee, note, owner, payee))
+    clear_record_caches()
+
+
+def delete_records_by_ids(record_ids):
+    if not record_ids:
+        return
+    placeholders = ",".join("?" * len(record_ids))
+    with transaction():
+        c.execute(f"SELECT DISTINCT owner_username, payee FROM records WHERE id IN ({placeholders})", record_ids)
+        affected = c.fetchall()
+        c.execute(f"DELETE FROM records WHERE id IN ({placeholders})", record_ids)
+        for owner, payee in affected:
+            refresh_payee_summary(owner, payee)
+    clear_record_caches()
 
 
 def delete_all_by_payee(owner, payee):
-    c.execute("DELETE FROM records WHERE owner_username=? AND payee=?", (owner, payee))
-    conn.commit()
+    with transaction():
+        c.execute("DELETE FROM records WHERE owner_username=? AND payee=?", (owner, payee))
+        c.execute("DELETE FROM payee_summary WHERE owner_username=? AND payee=?", (owner, payee))
+    clear_record_caches()
 
 
+@st.cache_data(ttl=60, show_spinner=False)
 def get_all_records(role):
     if role == "admin":
-        c.execute("SELECT * FROM records")
-        return c.fetchall()
+        with read_cursor() as rc:
+            rc.execute("SELECT owner_username, payee, total_received, total_paid, datetime FROM records")
+            return rc.fetchall()
     return []
 
 
 def delete_user(username):
-    c.execute("DELETE FROM users WHERE username=?", (username,))
-    c.execute("DELETE FROM records WHERE owner_username=?", (username,))
-    conn.commit()
+    with transaction():
+        c.execute("DELETE FROM users WHERE username=?", (username,))
+        c.execute("DELETE FROM records WHERE owner_username=?", (username,))
+        c.execute("DELETE FROM payee_summary WHERE owner_username=?", (username,))
+    _role_cache.pop(username, None)
+    get_all_users_for_admin.clear()
+    clear_record_caches()
 
 
 # -----------------------------
 # CSV Generator
 # -----------------------------
-def generate_csv(username):
-    c.execute("SELECT payee FROM records WHERE owner_username=? GROUP BY payee", (username,))
-    payees = [p[0] for p in c.fetchall()]
-    all_data = []
-    for payee in payees:
-        c.execute("SELECT received, paid_out, datetime, note FROM records WHERE owner_username=? AND payee=? ORDER BY datetime ASC",
-                  (username, payee))
-        recs = c.fetchall()
-        total_received = 0
-        total_paid = 0
-        for r in recs:
-            received = float(r[0] or 0)
-            paid = float(r[1] or 0)
-            total_received += received - paid
-            total_paid += paid
-            all_data.append({
-                "Payee": payee,
-                "Received": received,
-                "Paid": paid,
-                "Balance": total_received,
-                "Total Paid": total_paid,
-                "Date": r[2],
-                "Note": r[3]
-            })
-    df = pd.DataFrame(all_data)
-    return df.to_csv(index=False).encode('utf-8')
+def stream_csv(username):
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow(["Payee", "Received", "Paid", "Balance", "Total Paid", "Date", "Note"])
+    # Running totals come from SQLite; Python only formats the rows
+    with read_cursor() as rc:
+        w.writerows(rc.execute('''SELECT payee, received, paid_out,
+                                        SUM(received - paid_out) OVER running,
+                                        SUM(paid_out) OVER running,
+                                        datetime, note
+                                 FROM records WHERE owner_username=?
+                                 WINDOW running AS (PARTITION BY payee ORDER BY datetime, id)
+                                 ORDER BY payee, datetime, id''',
+                               (username,)))
+    return buf.getvalue().encode('utf-8')
 
 
 # -----------------------------
 # Streamlit UI
 # -----------------------------
-st.set_page_config(page_title="LenDenWebApp 💰", layout="centered")
-
-st.markdown("""
+# Static page chrome. It is still emitted on every rerun: Streamlit drops
+# any element a rerun doesn't redraw.
+APP_CSS = """
     <style>
     .stApp { background: linear-gradient(135deg, #F0B2B1,#ABEDD5, #C7E663); font-family: 'Arial Black', sans-serif; }
     .title {text-align:center; font-size:45px;}
@@ -171,11 +404,18 @@ st.markdown("""
     .red-bold {color:#8B0000; background-color:#FFE0E0; padding:2px 5px; border-radius:5px;}
     .developer-sign {position: fixed; top: 10px; right: 20px; color:black; font-weight:bold;}
 </style>
-""", unsafe_allow_html=True)
+"""
+
+HEADER_HTML = (
+    "<div class='title'>💰 LenDenWebApp</div>\n"
+    "<div class='sub'>Simple and Secure Record Management</div>\n"
+    "<div class='developer-sign'>Developed By: Mool Chandra Vishwakarma</div>"
+)
 
-st.markdown("<div class='title'>💰 LenDenWebApp</div>", unsafe_allow_html=True)
-st.markdown("<div class='sub'>Simple and Secure Record Management</div>", unsafe_allow_html=True)
-st.markdown("<div class='developer-sign'>Developed By: Mool Chandra Vishwakarma</div>", unsafe_allow_html=True)
+st.set_page_config(page_title="LenDenWebApp 💰", layout="centered")
+
+st.markdown(APP_CSS, unsafe_allow_html=True)
+st.markdown(HEADER_HTML, unsafe_allow_html=True)
 st.write("---")
 
 
@@ -196,10 +436,14 @@ if not st.session_state.logged_in:
     # Login + Reset Password Tab
     # -----------------------------
     with tab1:
-        u = st.text_input("Username", key="login_username")
-        p = st.text_input("Password", type="password", key="login_password")
-
-        if st.button("Login"):
+        # A form submits on Enter in one rerun instead of one per widget edit
+        with st.form("login_form"):
+            u = st.text_input("Username", key="login_username")
+            p = st.text_input("Password", type="password", key="login_password")
+            login_clicked = st.form_submit_button("Login")
+            reset_clicked = st.form_submit_button("Reset Password")
+
+        if login_clicked:
             user = verify_user(u, p)
             if user:
                 st.session_state.logged_in = True
@@ -211,7 +455,7 @@ if not st.session_state.logged_in:
                 st.error("❌ Invalid credentials")
 
         # Reset Password Button
-        if st.button("Reset Password"):
+        if reset_clicked:
             if not u.strip():
                 st.warning("Enter your username first to reset password.")
             else:
@@ -220,14 +464,14 @@ if not st.session_state.logged_in:
 
         # Show Reset Password Input if requested
         if st.session_state.show_reset and st.session_state.reset_user:
-            new_pass = st.text_input("Enter New Password", type="password", key="new_pass_input")
-            if st.button("Set New Password"):
+            with st.form("reset_password_form"):
+                new_pass = st.text_input("Enter New Password", type="password", key="new_pass_input")
+                set_clicked = st.form_submit_button("Set New Password")
+            if set_clicked:
                 if not new_pass.strip():
                     st.warning("Password cannot be empty.")
                 else:
-                    c.execute("UPDATE users SET password=? WHERE username=?",
-                              (hash_password(new_pass.strip()), st.session_state.reset_user))
-                    conn.commit()
+                    reset_password(st.session_state.reset_user, new_pass.strip())
                     st.success(f"✅ Password for '{st.session_state.reset_user}' reset successfully!")
                     st.session_state.show_reset = False
                     st.session_state.reset_user = None
@@ -236,9 +480,11 @@ if not st.session_state.logged_in:
     # Signup Tab
     # -----------------------------
     with tab2:
-        nu = st.text_input("New Username", key="signup_username")
-        np = st.text_input("New Password", type="password", key="signup_password")
-        if st.button("Signup"):
+        with st.form("signup_form"):
+            nu = st.text_input("New Username", key="signup_username")
+            np = st.text_input("New Password", type="password", key="signup_password")
+            signup_clicked = st.form_submit_button("Signup")
+        if signup_clicked:
             if add_user(nu, np):
                 st.success("🎉 Account created!")
             else:
@@ -255,68 +501,70 @@ else:
     if menu == "My Record":
         st.header("💼 My Record")
 
-        c.execute("SELECT SUM(received), SUM(paid_out) FROM records WHERE owner_username=?", 
-                  (st.session_state.username,))
-        rec = c.fetchone()
-        net_balance = (rec[0] or 0) - (rec[1] or 0)
+        summaries = get_payee_summaries(st.session_state.username)
+        net_balance = sum(s[1] or 0 for s in summaries)
         st.metric("💰 Net Balance", f"Rs.{net_balance:.2f}")
 
-        user_records = get_records(st.session_state.username)
-
         search_term = st.text_input("Search Payee")
         if search_term:
-            user_records = [r for r in user_records if search_term.lower() in r[5].lower()]
-
-        if user_records:
-            payees_seen = set()
-            for rec in user_records:
-                if rec[5] in payees_seen:
-                    continue
-                payees_seen.add(rec[5])
-                c.execute("SELECT SUM(received), SUM(paid_out), MAX(datetime) FROM records WHERE owner_username=? AND payee=? ORDER BY id DESC",
-                          (st.session_state.username, rec[5]))
-                sums = c.fetchone()
-                total_received = (sums[0] or 0) - (sums[1] or 0)
-                total_paid = sums[1] or 0
-                last_time = sums[2] or ""
+            summaries = [s for s in summaries if search_term.lower() in s[0].lower()]
+
+        if summaries:
+            histories = get_payee_histories(st.session_state.username)
+            for rec in summaries:
+                total_received = rec[1] or 0
+                total_paid = rec[2] or 0
+                last_time = rec[3] or ""
                 st.markdown(
-                    f"🧾 **Payee:** {rec[5]} | "
+                    f"🧾 **Payee:** {rec[0]} | "
                     f"<span class='green-bold'>💰 Balance: Rs.{total_received:.2f}</span> | "
                     f"<span class='red-bold'>💸 Paid: Rs.{total_paid:.2f}</span> | 🕒 {last_time}",
                     unsafe_allow_html=True
                 )
 
-                with st.expander(f"Show History for {rec[5]}", expanded=False):
-                    c.execute("SELECT id, received, paid_out, datetime, note FROM records WHERE owner_username=? AND payee=? ORDER BY datetime ASC",
-                              (st.session_state.username, rec[5]))
-                    history = c.fetchall()
+                with st.expander(f"Show History for {rec[0]}", expanded=False):
+                    history = histories[rec[0]]
                     if history:
-                        for h in history:
-                            col1, col2 = st.columns([4, 1])
-                            with col1:
-                                st.write(f"Received: Rs.{h[1]:.2f}, Paid: Rs.{h[2]:.2f}, Note: {h[4]}, Date: {h[3]}")
-                            with col2:
-                                confirm_key = f"chk_{h[0]}"
-                                delete_key = f"del_{h[0]}"
-                                checked = st.checkbox("Confirm delete", key=confirm_key)
-                                if checked:
-                                    if st.button("🗑 Delete", key=delete_key):
-                                        delete_record_by_id(h[0])
-                                        st.success("Deleted this record.")
-                                        st.rerun()
-
-                        warning_text = "⚠️ Optional: Delete entire payee history (only this payee)."
-                        st.warning(warning_text)
-                        chkall_key = f"chkall_{rec[5]}_{st.session_state.username}"
-                        delall_key = f"delall_{rec[5]}_{st.session_state.username}"
-                        checked_all = st.checkbox(f"Confirm delete all for {rec[5]}", key=chkall_key)
-                        if checked_all:
-                            if st.button(f"🗑 Delete All for {rec[5]}", key=delall_key):
-                                delete_all_by_payee(st.session_state.username, rec[5])
-                                st.success(f"All records for {rec[5]} deleted.")
+                        # Delete controls are per-row widgets, so only build them when asked for
+                        edit_key = f"edit_{rec[0]}_{st.session_state.username}"
+                        if not st.toggle("Edit mode", key=edit_key):
+                            st.dataframe(
+                                [{"received": h[1], "paid": h[2], "note": h[4], "date": h[3]} for h in history],
+                                hide_index=True,
+                                column_config={
+                                    "received": st.column_config.NumberColumn("Received", format="Rs.%.2f"),
+                                    "paid": st.column_config.NumberColumn("Paid", format="Rs.%.2f"),
+                                    "note": "Note",
+                                    "date": "Date",
+                                }
+                            )
+                        else:
+                            to_delete = []
+                            for h in history:
+                                col1, col2 = st.columns([4, 1])
+                                with col1:
+                                    st.write(f"Received: Rs.{h[1]:.2f}, Paid: Rs.{h[2]:.2f}, Note: {h[4]}, Date: {h[3]}")
+                                with col2:
+                                    if st.checkbox("Select", key=f"chk_{h[0]}"):
+                                        to_delete.append(h[0])
+                            delsel_key = f"delsel_{rec[0]}_{st.session_state.username}"
+                            if st.button(f"🗑 Delete selected ({len(to_delete)})", key=delsel_key, disabled=not to_delete):
+                                delete_records_by_ids(to_delete)
+                                st.success(f"Deleted {len(to_delete)} record(s).")
                                 st.rerun()
 
-        csv_data = generate_csv(st.session_state.username)
+                            warning_text = "⚠️ Optional: Delete entire payee history (only this payee)."
+                            st.warning(warning_text)
+                            chkall_key = f"chkall_{rec[0]}_{st.session_state.username}"
+                            delall_key = f"delall_{rec[0]}_{st.session_state.username}"
+                            checked_all = st.checkbox(f"Confirm delete all for {rec[0]}", key=chkall_key)
+                            if checked_all:
+                                if st.button(f"🗑 Delete All for {rec[0]}", key=delall_key):
+                                    delete_all_by_payee(st.session_state.username, rec[0])
+                                    st.success(f"All records for {rec[0]} deleted.")
+                                    st.rerun()
+
+        csv_data = functools.partial(stream_csv, st.session_state.username)
         st.download_button("📄 Download All Records (CSV)", csv_data, file_name="All_Records.csv", mime="text/csv")
 
         with st.form("update_record_form"):
@@ -349,13 +597,18 @@ else:
             st.header("📋 All Records")
             recs = get_all_records(st.session_state.role)
             if recs:
-                for r in recs:
-                    st.markdown(
-                        f"👤 {r[1]} | Payee: {r[5]} | "
-                        f"<span class='green-bold'>💰 Balance: Rs.{r[7]:.2f}</span> | "
-                        f"<span class='red-bold'>💸 Paid: Rs.{r[6]:.2f}</span> | 🕒 {r[4]}",
-                        unsafe_allow_html=True
-                    )
+                df = pd.DataFrame(recs, columns=["user", "payee", "total_received", "total_paid", "datetime"])
+                st.dataframe(
+                    df,
+                    hide_index=True,
+                    column_config={
+                        "user": "👤 User",
+                        "payee": "Payee",
+                        "total_received": st.column_config.NumberColumn("💰 Balance", format="Rs.%.2f"),
+                        "total_paid": st.column_config.NumberColumn("💸 Paid", format="Rs.%.2f"),
+                        "datetime": "🕒 Date",
+                    }
+                )
             else:
                 st.info("No records found.")
         else:
@@ -364,8 +617,7 @@ else:
     elif menu == "Manage Users":
         if st.session_state.role == "admin":
             st.header("👑 Manage Users")
-            c.execute("SELECT username, role FROM users")
-            users = c.fetchall()
+            users = get_all_users_for_admin()
             for u in users:
                 st.write(f"👤 {u[0]} ({u[1]})")
                 if u[0] != "admin":